@@ -1,47 +1,311 @@
-from fastapi import FastAPI, Request, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, Request, File, UploadFile, Form, HTTPException, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.encoders import jsonable_encoder
 import uvicorn
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError, CollectionInvalid
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 import os
-from datetime import datetime, timezone
+import asyncio
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
 import csv
 import random
 import json
 from bson import ObjectId
-from metrics import calculate_metrics, detect_column_type
+from metrics import calculate_metrics, detect_column_type, flatten_metrics, flatten_errors, ERROR_KINDS
+from label_sidecar import (
+    convert_row_values, write_label_sidecar, load_label_sidecar,
+    read_sidecar_rows, remove_label_file, prefill_sidecar_cache
+)
+from storage import atomic_write
+from cascade_delete import (
+    DELETION_TOMBSTONE_TTL_SECONDS, DELETION_LEASE_SECONDS, mark_use_case_deleting, run_cascade_delete, resume_pending_deletions, delete_evaluation_records
+)
 from dotenv import load_dotenv
 from pydantic import BaseModel
 from bson.errors import InvalidId
 
-app = FastAPI()
+UPLOAD_FOLDER = 'uploads'
+
+# Number of most recently uploaded label files loaded into the sidecar cache at startup
+WARMUP_LABEL_FILES = 5
+WARMUP_RETRY_SECONDS = 5
+
+@asynccontextmanager
+async def lifespan(app):
+    """Warm up the worker in the background; /ready reports when it is done"""
+    app.state.ready = False
+    warmup_task = asyncio.create_task(warmup(app))
+    yield
+    warmup_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
 
-# Load environment variables and setup
-load_dotenv()
+async def warmup(app):
+    """One-time worker warmup: environment, uploads directory, DB pool and indexes,
+    compiled templates and cached label files. Retried until it succeeds, then
+    followed by the periodic maintenance sweep."""
+    while True:
+        try:
+            await run_in_threadpool(warmup_worker)
+            break
+        except Exception as e:
+            print(f"Warmup failed, retrying in {WARMUP_RETRY_SECONDS}s: {str(e)}")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+    app.state.ready = True
 
-# Ensure the uploads directory exists
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+    # Run the sweep once per deletion lease, so a deletion is retried at most
+    # about two leases after its owner went away
+    while True:
+        await run_in_threadpool(sweep_worker)
+        await asyncio.sleep(DELETION_LEASE_SECONDS)
+
+def warmup_worker():
+    # Ensure the uploads directory exists
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+
+    db = get_db_connection()
+    db.command('ping')
+
+    for template_name in templates.env.list_templates():
+        templates.env.get_template(template_name)
+
+    backfill_metric_rollup(db)
+
+    # Prefill stops at WARMUP_LABEL_FILES files or once the sidecar cache budget is used up
+    for label_file in db.label_files.find().sort('uploaded_at', -1).limit(WARMUP_LABEL_FILES):
+        if not prefill_sidecar_cache(label_file['file_path'], label_file.get('column_types', {})):
+            break
+
+def sweep_worker():
+    """Periodic maintenance: pick up use case deletions interrupted by a restart or
+    whose owner stopped sending heartbeats, and write rollup rows for evaluation
+    iterations stored without them"""
+    for description, task in [
+        ('resuming use case deletions', resume_pending_deletions),
+        ('backfilling the metric rollup', backfill_metric_rollup)
+    ]:
+        try:
+            task(get_db_connection())
+        except Exception as e:
+            print(f"Error {description}: {str(e)}")
+
+_db = None
+_db_lock = threading.Lock()
 
 # Update database connection
 def get_db_connection():
-    """Connect to Cosmos DB emulator using MongoDB API"""
-    connection_string = os.getenv('DB_CONNECTION_STRING', 'mongodb://localhost:27017/')
-    client = MongoClient(connection_string)
-    
-    # Create database if it doesn't exist
-    db = client['evaluation_db']
-    
-    # Create collections if they don't exist
-    collections = ['use_cases', 'label_files', 'evaluation_sets', 'extraction_results', 'evaluation_iterations']
+    """Connect to Cosmos DB emulator using MongoDB API.
+    The client and its connection pool are created once per worker process."""
+    global _db
+    if _db is not None:
+        return _db
+
+    with _db_lock:
+        if _db is None:
+            # Load environment variables and setup
+            load_dotenv()
+            connection_string = os.getenv('DB_CONNECTION_STRING', 'mongodb://localhost:27017/')
+            client = MongoClient(connection_string)
+            db = client['evaluation_db']
+            init_db(db)
+            _db = db
+    return _db
+
+def init_db(db):
+    """Create collections and indexes if they don't exist"""
+    collections = ['use_cases', 'label_files', 'evaluation_sets', 'extraction_results', 'evaluation_iterations',
+                   'evaluation_metrics', 'evaluation_errors', 'migrations', 'use_case_deletions']
+    existing = db.list_collection_names()
     for collection in collections:
-        if collection not in db.list_collection_names():
-            db.create_collection(collection)
-    
-    return db
+        if collection not in existing:
+            try:
+                db.create_collection(collection)
+            except CollectionInvalid:
+                # Created concurrently by another worker
+                pass
+
+    # Indexes for the flattened metrics rollup (trend, leaderboard and comparison queries)
+    db.evaluation_metrics.create_index([('use_case_id', 1), ('set_name', 1), ('field', 1), ('created_at', 1)])
+    db.evaluation_metrics.create_index([('evaluation_iteration_id', 1), ('set_name', 1), ('field', 1)], unique=True)
+    for metric in LEADERBOARD_METRICS:
+        db.evaluation_metrics.create_index(
+            [('use_case_id', 1), ('set_name', 1), ('field', 1), (metric, -1), ('created_at', -1)]
+        )
+
+    # Index for the per-field error index (mismatched, missing and spurious document_ids)
+    db.evaluation_errors.create_index(
+        [('evaluation_iteration_id', 1), ('set_name', 1), ('field', 1), ('kind', 1), ('chunk', 1)],
+        unique=True
+    )
+
+    # Tombstones of completed use case deletions expire after a week
+    db.use_case_deletions.create_index('completed_at', expireAfterSeconds=DELETION_TOMBSTONE_TTL_SECONDS)
+    db.use_case_deletions.create_index([('name', 1), ('completed_at', -1)])
+
+# Label files of a use case are ordered by upload time, ties broken by _id
+LABEL_FILE_ORDER = [('uploaded_at', -1), ('_id', -1)]
+
+def replace_older_label_files(db, label_file):
+    """Delete the label files of a use case uploaded before label_file, with their
+    evaluation sets and files. Concurrent uploads agree on the same order, so the
+    newest one survives."""
+    older = {
+        'use_case_id': label_file['use_case_id'],
+        '$or': [
+            {'uploaded_at': {'$lt': label_file['uploaded_at']}},
+            {'uploaded_at': label_file['uploaded_at'], '_id': {'$lt': label_file['_id']}}
+        ]
+    }
+    old_label_files = list(db.label_files.find(older, {'file_path': 1}))
+    if not old_label_files:
+        return
+    old_ids = [old_file['_id'] for old_file in old_label_files]
+    db.evaluation_sets.delete_many({'label_file_id': {'$in': old_ids}})
+    db.label_files.delete_many({'_id': {'$in': old_ids}})
+    for old_file in old_label_files:
+        remove_label_file(old_file['file_path'])
+
+def find_active_use_case(db, use_case_name):
+    """Find a use case by name, ignoring use cases that are being deleted"""
+    return db.use_cases.find_one({'name': use_case_name, 'status': {'$ne': 'deleting'}})
+
+def is_use_case_active(db, use_case_id):
+    """Check that a use case still exists and is not being deleted"""
+    return db.use_cases.count_documents({'_id': use_case_id, 'status': {'$ne': 'deleting'}}, limit=1) > 0
+
+def store_metric_rollup(db, evaluation_iteration):
+    """Write one rollup row per (set, field) of an evaluation iteration"""
+    insert_derived_rows(db.evaluation_metrics, flatten_metrics(evaluation_iteration))
+
+def insert_derived_rows(collection, rows):
+    """Insert rows derived from an evaluation iteration, ignoring rows that already exist"""
+    if not rows:
+        return
+    try:
+        collection.insert_many(rows, ordered=False)
+    except BulkWriteError as e:
+        # Rows already written by a concurrent backfill or an earlier attempt are fine
+        if any(error['code'] != 11000 for error in e.details.get('writeErrors', [])):
+            raise
+
+METRIC_ROLLUP_MIGRATION = 'metric_rollup_backfill'
+METRIC_ROLLUP_BACKFILL_BATCH = 500
+
+# An iteration is inserted some time after its _id is generated, so the high-water
+# mark stays this far behind the present and recent iterations are checked again
+METRIC_ROLLUP_BACKFILL_LAG_SECONDS = 300
+
+def backfill_metric_rollup(db):
+    """Write rollup rows for evaluation iterations stored without them: iterations
+    from before the rollup existed, or written by workers of an older version.
+
+    Only iterations past the high-water mark recorded in migrations are scanned,
+    so this is cheap enough to run on every warmup and sweep."""
+    marker = db.migrations.find_one({'_id': METRIC_ROLLUP_MIGRATION}) or {}
+    query = {}
+    if marker.get('last_iteration_id'):
+        query['_id'] = {'$gt': marker['last_iteration_id']}
+    settled_before = ObjectId.from_datetime(
+        datetime.now(timezone.utc) - timedelta(seconds=METRIC_ROLLUP_BACKFILL_LAG_SECONDS)
+    )
+
+    cursor = db.evaluation_iterations.find(query, {'_id': 1}).sort('_id', 1).batch_size(METRIC_ROLLUP_BACKFILL_BATCH)
+    batch = []
+    for iteration in cursor:
+        batch.append(iteration['_id'])
+        if len(batch) == METRIC_ROLLUP_BACKFILL_BATCH:
+            _backfill_metric_rollup_batch(db, batch, settled_before)
+            batch = []
+    if batch:
+        _backfill_metric_rollup_batch(db, batch, settled_before)
+
+def _backfill_metric_rollup_batch(db, iteration_ids, settled_before):
+    rolled_up = set(db.evaluation_metrics.distinct(
+        'evaluation_iteration_id', {'evaluation_iteration_id': {'$in': iteration_ids}}
+    ))
+    missing = [iteration_id for iteration_id in iteration_ids if iteration_id not in rolled_up]
+    for iteration in db.evaluation_iterations.find({'_id': {'$in': missing}}):
+        store_metric_rollup(db, iteration)
+
+    # Advance the mark past the settled part of the batch only
+    settled = [iteration_id for iteration_id in iteration_ids if iteration_id < settled_before]
+    if settled:
+        db.migrations.update_one(
+            {'_id': METRIC_ROLLUP_MIGRATION},
+            {
+                '$max': {'last_iteration_id': settled[-1]},
+                '$set': {'updated_at': datetime.now(timezone.utc)}
+            },
+            upsert=True
+        )
+
+ERROR_INDEX_CHUNK_SIZE = 10000
+
+def store_error_index(db, evaluation_iteration, errors_by_set):
+    """Write the document_ids of mismatched, missing and spurious values per (set, field)"""
+    rows = flatten_errors(evaluation_iteration, errors_by_set, ERROR_INDEX_CHUNK_SIZE)
+    insert_derived_rows(db.evaluation_errors, rows)
+
+def get_error_counts(db, evaluation_iteration_id):
+    """Return the number of errors per set, field and kind of an evaluation iteration"""
+    counts = {}
+    for row in db.evaluation_errors.find(
+        {'evaluation_iteration_id': evaluation_iteration_id, 'chunk': 0},
+        {'set_name': 1, 'field': 1, 'kind': 1, 'total': 1}
+    ):
+        field_counts = counts.setdefault(row['set_name'], {}).setdefault(
+            row['field'], {kind: 0 for kind in ERROR_KINDS}
+        )
+        field_counts[row['kind']] = row['total']
+    return counts
+
+def page_error_index(db, evaluation_iteration_id, set_name, field, kinds, offset, limit):
+    """Return the total number of errors and one page of (kind, document_id) pairs.
+    Only the index chunks covering the requested page are loaded."""
+    query = {'evaluation_iteration_id': evaluation_iteration_id, 'set_name': set_name, 'field': field}
+    totals = {
+        row['kind']: row['total']
+        for row in db.evaluation_errors.find({**query, 'kind': {'$in': kinds}, 'chunk': 0}, {'kind': 1, 'total': 1})
+    }
+
+    items = []
+    start = offset
+    for kind in kinds:
+        total = totals.get(kind, 0)
+        if start >= total:
+            start -= total
+            continue
+        end = min(total, start + limit - len(items))
+        first_chunk = start // ERROR_INDEX_CHUNK_SIZE
+        chunks = db.evaluation_errors.find({
+            **query,
+            'kind': kind,
+            'chunk': {'$gte': first_chunk, '$lte': (end - 1) // ERROR_INDEX_CHUNK_SIZE}
+        }).sort('chunk', 1)
+        document_ids = [doc_id for chunk in chunks for doc_id in chunk['document_ids']]
+        base = first_chunk * ERROR_INDEX_CHUNK_SIZE
+        items.extend((kind, doc_id) for doc_id in document_ids[start - base:end - base])
+        start = 0
+        if len(items) >= limit:
+            break
+
+    return sum(totals.values()), items
+
+def serialize_metric_row(row):
+    """Convert a rollup row into a JSON-serializable dict"""
+    row = dict(row)
+    row.pop('_id', None)
+    row.pop('use_case_id', None)
+    row['evaluation_iteration_id'] = str(row['evaluation_iteration_id'])
+    row['created_at'] = row['created_at'].isoformat()
+    return row
 
 def split_csv_rows(file_path):
     """Split the rows of a CSV file into golden and test sets.
@@ -76,9 +340,33 @@ def split_csv_rows(file_path):
     except csv.Error:
         raise ValueError("Invalid CSV file format")
 
+def process_label_file(file_path):
+    """Detect the column types of a label file and store its typed rows in a
+    binary sidecar so reads skip CSV parsing. Returns the column types."""
+    with open(file_path, 'r') as csvfile:
+        reader = csv.DictReader(csvfile)
+        rows = list(reader)
+        
+        # Detect column types
+        column_types = {}
+        for field in reader.fieldnames:
+            if field not in ['document_id', 'row_id']:  # Explicitly exclude row_id
+                values = [row[field] for row in rows]
+                column_types[field] = detect_column_type(values)
+
+    write_label_sidecar(file_path, reader.fieldnames, rows, column_types)
+    return column_types
+
 def get_csv_content(file_path, document_ids, column_types=None):
-    """Read CSV file and return rows for specified document IDs with proper type conversion"""
+    """Read CSV file and return rows for specified document IDs with proper type conversion.
+    Uses the pre-parsed sidecar of the label file when it is present and up to date."""
     try:
+        sidecar = load_label_sidecar(file_path, column_types)
+        if sidecar is not None:
+            return read_sidecar_rows(sidecar, document_ids)
+
+        if document_ids is not None:
+            document_ids = set(document_ids)
         with open(file_path, 'r') as csvfile:
             reader = csv.DictReader(csvfile)
             rows = []
@@ -86,18 +374,7 @@ def get_csv_content(file_path, document_ids, column_types=None):
                 if document_ids is None or row['document_id'] in document_ids:
                     # Convert values according to detected types
                     if column_types:
-                        for field, value in row.items():
-                            if field != 'document_id':
-                                try:
-                                    if column_types.get(field) == 'integer':
-                                        row[field] = int(value) if value.strip() else 0
-                                    elif column_types.get(field) == 'float':
-                                        row[field] = float(value) if value.strip() else 0.0
-                                    elif column_types.get(field) == 'boolean':
-                                        row[field] = value.lower() in ('true', '1', 'yes', 'y')
-                                    # Keep as string if type is string or unknown
-                                except (ValueError, TypeError):
-                                    print(f"Warning: Could not convert {field} value '{value}' to {column_types.get(field)}")
+                        convert_row_values(row, column_types)
                     rows.append(row)
             return rows
     except Exception as e:
@@ -108,6 +385,13 @@ def get_csv_content(file_path, document_ids, column_types=None):
 async def index():
     return "Welcome to the Evaluation Web-Service!"
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: succeeds only once the worker has finished its warmup"""
+    if not app.state.ready:
+        return JSONResponse({'status': 'warming_up'}, status_code=503)
+    return JSONResponse({'status': 'ready'})
+
 @app.get("/create_use_case.html")
 async def create_use_case_page(request: Request):
     return templates.TemplateResponse('create_use_case.html', {"request": request})
@@ -124,6 +408,11 @@ async def create_use_case(use_case: UseCase):
         
         # Check if use case with this name already exists
         existing = db.use_cases.find_one({'name': use_case.name})
+        if existing and existing.get('status') == 'deleting':
+            raise HTTPException(
+                status_code=409,
+                detail=f"Use case with name '{use_case.name}' is still being deleted"
+            )
         if existing:
             raise HTTPException(
                 status_code=400,
@@ -171,50 +460,51 @@ async def upload_label_file(
         if not file.filename.endswith('.csv'):
             raise HTTPException(status_code=400, detail='Only CSV files are allowed')
 
-        file_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        with open(file_path, 'wb') as f:
+        # Unique stored name so workers sharing UPLOAD_FOLDER never write the same file
+        file_path = os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{os.path.basename(file.filename)}")
+        with atomic_write(file_path) as f:
             f.write(file.file.read())
 
         db = get_db_connection()
-        use_cases = db.use_cases
-        use_case = use_cases.find_one({'name': use_case_name})
+        use_case = find_active_use_case(db, use_case_name)
 
         if not use_case:
             os.remove(file_path)
             raise HTTPException(status_code=404, detail='Use case not found')
 
         use_case_id = use_case['_id']
-        
-        # Delete old label files and their data
-        old_label_files = db.label_files.find({'use_case_id': use_case_id})
-        for old_file in old_label_files:
-            if os.path.exists(old_file['file_path']):
-                os.remove(old_file['file_path'])
-        db.label_files.delete_many({'use_case_id': use_case_id})
-        db.evaluation_sets.delete_many({'use_case_id': use_case_id})
 
         # Validate CSV structure
         try:
-            golden_set, test_set = split_csv_rows(file_path)
+            golden_set, test_set = await run_in_threadpool(split_csv_rows, file_path)
         except ValueError as ve:
             os.remove(file_path)
             raise HTTPException(status_code=400, detail=str(ve))
 
-        # Detect column types
-        with open(file_path, 'r') as csvfile:
-            reader = csv.DictReader(csvfile)
-            rows = list(reader)
-            
-            # Detect column types
-            column_types = {}
-            for field in reader.fieldnames:
-                if field not in ['document_id', 'row_id']:  # Explicitly exclude row_id
-                    values = [row[field] for row in rows]
-                    column_types[field] = detect_column_type(values)
+        # Detect column types and write the sidecar off the event loop
+        column_types = await run_in_threadpool(process_label_file, file_path)
+
+        # The use case may have been deleted while the file was processed
+        if not is_use_case_active(db, use_case_id):
+            raise HTTPException(status_code=404, detail='Use case not found')
+
+        # Store the evaluation sets first so a label file is never visible without them
+        label_file_id = ObjectId()
+        evaluation_sets = db.evaluation_sets
+        evaluation_set = {
+            'use_case_id': use_case_id,
+            'label_file_id': label_file_id,
+            'gold_set': golden_set,
+            'test_set': test_set,
+            'created_at': datetime.now(timezone.utc),
+            'total_documents': len(golden_set) + len(test_set)
+        }
+        evaluation_sets.insert_one(evaluation_set)
 
         # Store file metadata with validation status
         label_files = db.label_files
         label_file = {
+            '_id': label_file_id,
             'use_case_id': use_case_id,
             'file_path': file_path,
             'original_filename': file.filename,
@@ -225,19 +515,16 @@ async def upload_label_file(
             'validation_status': 'valid',
             'column_types': column_types
         }
-        label_file_id = label_files.insert_one(label_file).inserted_id
+        label_files.insert_one(label_file)
 
-        # Store the evaluation sets
-        evaluation_sets = db.evaluation_sets
-        evaluation_set = {
-            'use_case_id': use_case_id,
-            'label_file_id': label_file_id,
-            'gold_set': golden_set,
-            'test_set': test_set,
-            'created_at': datetime.now(timezone.utc),
-            'total_documents': len(golden_set) + len(test_set)
-        }
-        evaluation_sets.insert_one(evaluation_set)
+        # A deletion marked before the inserts may have missed them: undo them
+        if not is_use_case_active(db, use_case_id):
+            db.label_files.delete_one({'_id': label_file_id})
+            db.evaluation_sets.delete_many({'label_file_id': label_file_id})
+            raise HTTPException(status_code=404, detail='Use case not found')
+
+        # Replace older label files only now that the new one is stored
+        replace_older_label_files(db, label_file)
 
         return JSONResponse({
             'message': 'Label file uploaded and processed successfully',
@@ -247,16 +534,23 @@ async def upload_label_file(
         }, status_code=201)
 
     except Exception as e:
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
+        if file_path:
+            remove_label_file(file_path)
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/generate_report/{evaluation_iteration_id}")
-async def generate_report(evaluation_iteration_id: int):
+async def generate_report(evaluation_iteration_id: str):
+    try:
+        eval_id = ObjectId(evaluation_iteration_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail='Invalid evaluation ID format')
+
     db = get_db_connection()
     evaluation_iterations = db.evaluation_iterations
 
-    evaluation_iteration = evaluation_iterations.find_one({'_id': evaluation_iteration_id})
+    evaluation_iteration = evaluation_iterations.find_one({'_id': eval_id})
     if not evaluation_iteration:
         raise HTTPException(status_code=404, detail='Evaluation iteration not found')
 
@@ -284,13 +578,13 @@ async def generate_report(evaluation_iteration_id: int):
             'cost_metrics': {'average_cost': 0.12, 'cost_percentiles': [0.06, 0.12, 0.18]}
         },
         'detailed_report': 'Detailed report data here',
-        'error_report': 'Error report data here'
+        'error_report': get_error_counts(db, eval_id)
     }
 
-    return JSONResponse(report)
+    return JSONResponse(jsonable_encoder(report, custom_encoder={ObjectId: str}))
 
 @app.get("/view_report/{evaluation_iteration_id}")
-async def view_report(request: Request, evaluation_iteration_id: int):
+async def view_report(request: Request, evaluation_iteration_id: str):
     return templates.TemplateResponse('view_report.html', {
         "request": request,
         "evaluation_iteration_id": evaluation_iteration_id
@@ -303,9 +597,7 @@ async def view_use_case(request: Request, use_case_name: str):
         db = get_db_connection()
         
         # Find the use case - use _id for partitioning
-        use_case = db.use_cases.find_one({
-            'name': use_case_name
-        })
+        use_case = find_active_use_case(db, use_case_name)
         if not use_case:
             return templates.TemplateResponse(
                 "error.html",
@@ -331,7 +623,8 @@ async def view_use_case(request: Request, use_case_name: str):
                 file['total_documents'] = eval_set['total_documents']
                 
                 # Get test set content from CSV file
-                test_set_content = get_csv_content(
+                test_set_content = await run_in_threadpool(
+                    get_csv_content,
                     file['file_path'], 
                     eval_set['test_set'],
                     column_types=file.get('column_types', {})
@@ -375,7 +668,7 @@ async def list_use_cases(request: Request):
     """Display list of all use cases"""
     try:
         db = get_db_connection()
-        all_use_cases = list(db.use_cases.find().sort('created_at', -1))
+        all_use_cases = list(db.use_cases.find({'status': {'$ne': 'deleting'}}).sort('created_at', -1))
         return templates.TemplateResponse(
             "use_cases.html",
             {"request": request, "use_cases": all_use_cases}
@@ -402,14 +695,14 @@ async def upload_extraction_result(
         db = get_db_connection()
         
         # Find use case
-        use_case = db.use_cases.find_one({'name': use_case_name})
+        use_case = find_active_use_case(db, use_case_name)
         if not use_case:
             raise HTTPException(status_code=404, detail=f'Use case "{use_case_name}" not found')
             
         # Check if label file exists first
         label_file = db.label_files.find_one(
             {'use_case_id': use_case['_id']},
-            sort=[('uploaded_at', -1)]
+            sort=LABEL_FILE_ORDER
         )
         if not label_file:
             raise HTTPException(
@@ -417,11 +710,8 @@ async def upload_extraction_result(
                 detail='Please upload a label file before uploading extraction results'
             )
             
-        # Find latest evaluation set for the use case
-        latest_eval_set = db.evaluation_sets.find_one(
-            {'use_case_id': use_case['_id']},
-            sort=[('created_at', -1)]
-        )
+        # Find the evaluation set of that label file
+        latest_eval_set = db.evaluation_sets.find_one({'label_file_id': label_file['_id']})
         
         if not latest_eval_set:
             raise HTTPException(
@@ -471,7 +761,8 @@ async def upload_extraction_result(
                             )
 
             # Validate document IDs match
-            label_doc_ids = set(row['document_id'] for row in get_csv_content(label_file['file_path'], None, column_types))
+            label_rows = await run_in_threadpool(get_csv_content, label_file['file_path'], None, column_types)
+            label_doc_ids = set(row['document_id'] for row in label_rows)
             result_doc_ids = set(row['document_id'] for row in extraction_results)
             print(extraction_results)
 
@@ -481,6 +772,10 @@ async def upload_extraction_result(
                     detail=f'Document IDs in extraction results do not match label file, {result_doc_ids.difference(label_doc_ids)} are missing in label set'
                 )
             
+            # The use case may have been deleted while the results were checked
+            if not is_use_case_active(db, use_case['_id']):
+                raise HTTPException(status_code=404, detail=f'Use case "{use_case_name}" not found')
+
             # Store extraction results
             extraction_result = {
                 'use_case_id': use_case['_id'],
@@ -490,41 +785,59 @@ async def upload_extraction_result(
             }
             
             result_id = db.extraction_results.insert_one(extraction_result).inserted_id
+            iteration_id = ObjectId()
             
-            # Calculate metrics for different sets
-            test_set_metrics = calculate_metrics(
-                get_csv_content(label_file['file_path'], None, column_types=label_file.get('column_types', {})),
-                extraction_results,
-                latest_eval_set['test_set']
-            )
-            
-            golden_set_metrics = calculate_metrics(
-                get_csv_content(label_file['file_path'], None, column_types=label_file.get('column_types', {})),
-                extraction_results,
-                latest_eval_set['gold_set']
-            )
-            
-            total_metrics = calculate_metrics(
-                get_csv_content(label_file['file_path'], None, column_types=label_file.get('column_types', {})),
-                extraction_results,
-                list(label_doc_ids)
-            )
-            
-            # Create evaluation iteration
-            evaluation_iteration = {
-                'use_case_id': use_case['_id'],
-                'extraction_result_id': result_id,
-                'label_file_id': label_file['_id'],
-                'created_at': datetime.now(timezone.utc),
-                'metrics': {
-                    'test_set': test_set_metrics,
-                    'golden_set': golden_set_metrics,
-                    'total': total_metrics
+            try:
+                # Calculate metrics for different sets, recording which documents were wrong
+                errors_by_set = {'test_set': {}, 'golden_set': {}, 'total': {}}
+                test_set_metrics = calculate_metrics(
+                    label_rows,
+                    extraction_results,
+                    latest_eval_set['test_set'],
+                    errors=errors_by_set['test_set']
+                )
+                
+                golden_set_metrics = calculate_metrics(
+                    label_rows,
+                    extraction_results,
+                    latest_eval_set['gold_set'],
+                    errors=errors_by_set['golden_set']
+                )
+                
+                total_metrics = calculate_metrics(
+                    label_rows,
+                    extraction_results,
+                    list(label_doc_ids),
+                    errors=errors_by_set['total']
+                )
+                
+                # Create evaluation iteration
+                evaluation_iteration = {
+                    '_id': iteration_id,
+                    'use_case_id': use_case['_id'],
+                    'extraction_result_id': result_id,
+                    'label_file_id': label_file['_id'],
+                    'created_at': datetime.now(timezone.utc),
+                    'metrics': {
+                        'test_set': test_set_metrics,
+                        'golden_set': golden_set_metrics,
+                        'total': total_metrics
+                    }
                 }
-            }
-            
-            iteration_id = db.evaluation_iterations.insert_one(evaluation_iteration).inserted_id
-            
+                
+                # Write the derived rows first so an iteration only exists once they do
+                store_metric_rollup(db, evaluation_iteration)
+                store_error_index(db, evaluation_iteration, errors_by_set)
+                db.evaluation_iterations.insert_one(evaluation_iteration)
+
+                # A deletion marked before the inserts may have missed them
+                if not is_use_case_active(db, use_case['_id']):
+                    raise HTTPException(status_code=404, detail=f'Use case "{use_case_name}" not found')
+            except Exception:
+                # Leave nothing behind so the upload can simply be retried
+                delete_evaluation_records(db, {'_id': iteration_id, 'extraction_result_id': result_id})
+                raise
+                
             return JSONResponse({
                 'message': 'Extraction results uploaded and evaluated successfully',
                 'evaluation_iteration_id': str(iteration_id),
@@ -539,6 +852,8 @@ async def upload_extraction_result(
             raise HTTPException(status_code=400, detail=f'Invalid JSON format: {str(e)}')
         
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/evaluation/{evaluation_iteration_id}")
@@ -579,7 +894,8 @@ async def view_evaluation(request: Request, evaluation_iteration_id: str):
             if not eval_set:
                 raise ValueError("Evaluation set not found")
                 
-            test_set_labels = get_csv_content(
+            test_set_labels = await run_in_threadpool(
+                get_csv_content,
                 label_file['file_path'], 
                 eval_set['test_set'],
                 column_types=label_file.get('column_types', {})
@@ -613,34 +929,280 @@ async def view_evaluation(request: Request, evaluation_iteration_id: str):
             status_code=500
         )
 
+METRIC_NAMES = ('precision', 'recall', 'f1_score', 'true_positives', 'false_positives', 'false_negatives')
+
+# Metrics a leaderboard can rank by, each backed by its own index
+LEADERBOARD_METRICS = ('precision', 'recall', 'f1_score')
+MAX_LEADERBOARD_LIMIT = 100
+MAX_TREND_LIMIT = 1000
+
+@app.get("/use_case/{use_case_name}/metrics/trend")
+async def metrics_trend(
+    use_case_name: str,
+    field: str = None,
+    set_name: str = 'test_set',
+    since: datetime = None,
+    until: datetime = None,
+    limit: int = MAX_TREND_LIMIT
+):
+    """Return metrics of a use case across evaluation iterations, oldest first,
+    optionally restricted to iterations created in [since, until)"""
+    try:
+        if limit < 1:
+            raise HTTPException(status_code=400, detail='limit must be positive')
+
+        db = get_db_connection()
+
+        use_case = find_active_use_case(db, use_case_name)
+        if not use_case:
+            raise HTTPException(status_code=404, detail='Use case not found')
+
+        query = {'use_case_id': use_case['_id'], 'set_name': set_name}
+        if field:
+            query['field'] = field
+        if since or until:
+            query['created_at'] = {}
+            if since:
+                query['created_at']['$gte'] = since
+            if until:
+                query['created_at']['$lt'] = until
+        rows = db.evaluation_metrics.find(query).sort([('field', 1), ('created_at', 1)]).limit(
+            min(limit, MAX_TREND_LIMIT)
+        )
+
+        return JSONResponse({
+            'use_case': use_case_name,
+            'set_name': set_name,
+            'trend': [serialize_metric_row(row) for row in rows]
+        })
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/use_case/{use_case_name}/metrics/leaderboard")
+async def metrics_leaderboard(
+    use_case_name: str,
+    field: str,
+    set_name: str = 'test_set',
+    metric: str = 'f1_score',
+    limit: int = 10
+):
+    """Return the best evaluation iterations of a use case for one field and metric"""
+    try:
+        if metric not in LEADERBOARD_METRICS:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Unknown metric: {metric}. Expected one of {", ".join(LEADERBOARD_METRICS)}'
+            )
+
+        db = get_db_connection()
+
+        use_case = find_active_use_case(db, use_case_name)
+        if not use_case:
+            raise HTTPException(status_code=404, detail='Use case not found')
+
+        rows = db.evaluation_metrics.find(
+            {'use_case_id': use_case['_id'], 'set_name': set_name, 'field': field}
+        ).sort([(metric, -1), ('created_at', -1)]).limit(min(max(limit, 1), MAX_LEADERBOARD_LIMIT))
+
+        return JSONResponse({
+            'use_case': use_case_name,
+            'set_name': set_name,
+            'field': field,
+            'metric': metric,
+            'leaderboard': [serialize_metric_row(row) for row in rows]
+        })
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/evaluation/{evaluation_iteration_id}/errors")
+async def evaluation_errors(
+    evaluation_iteration_id: str,
+    field: str,
+    set_name: str = 'test_set',
+    kind: str = None,
+    page: int = 1,
+    page_size: int = 50
+):
+    """Return one page of documents where a field was wrong, with label and prediction side by side"""
+    try:
+        try:
+            eval_id = ObjectId(evaluation_iteration_id)
+        except InvalidId:
+            raise HTTPException(status_code=400, detail='Invalid evaluation ID format')
+
+        if kind is not None and kind not in ERROR_KINDS:
+            raise HTTPException(status_code=400, detail=f'Unknown error kind: {kind}')
+        if page < 1 or page_size < 1:
+            raise HTTPException(status_code=400, detail='page and page_size must be positive')
+
+        db = get_db_connection()
+
+        evaluation = db.evaluation_iterations.find_one({'_id': eval_id}, {'metrics': 0})
+        if not evaluation:
+            raise HTTPException(status_code=404, detail='Evaluation not found')
+
+        kinds = [kind] if kind else list(ERROR_KINDS)
+        total, items = page_error_index(db, eval_id, set_name, field, kinds, (page - 1) * page_size, page_size)
+
+        document_ids = [doc_id for _, doc_id in items]
+        label_file = db.label_files.find_one({'_id': evaluation['label_file_id']})
+        labels = {}
+        if label_file and document_ids:
+            label_rows = await run_in_threadpool(
+                get_csv_content,
+                label_file['file_path'],
+                document_ids,
+                column_types=label_file.get('column_types', {})
+            )
+            labels = {row['document_id']: row.get(field) for row in label_rows}
+        predictions = {}
+        if document_ids:
+            # Only the page's entries of the extraction results leave the database
+            page_results = db.extraction_results.aggregate([
+                {'$match': {'_id': evaluation['extraction_result_id']}},
+                {'$project': {'results': {'$filter': {
+                    'input': '$results',
+                    'cond': {'$in': ['$$this.document_id', document_ids]}
+                }}}}
+            ])
+            for extraction_result in page_results:
+                for result in extraction_result['results']:
+                    predictions.setdefault(result['document_id'], result.get(field))
+
+        return JSONResponse(jsonable_encoder({
+            'evaluation_iteration_id': evaluation_iteration_id,
+            'set_name': set_name,
+            'field': field,
+            'page': page,
+            'page_size': page_size,
+            'total': total,
+            'errors': [
+                {
+                    'document_id': doc_id,
+                    'kind': error_kind,
+                    'label': labels.get(doc_id),
+                    'prediction': predictions.get(doc_id)
+                }
+                for error_kind, doc_id in items
+            ]
+        }))
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/evaluation/{evaluation_iteration_id}/compare/{other_iteration_id}")
+async def compare_evaluations(evaluation_iteration_id: str, other_iteration_id: str, set_name: str = 'test_set'):
+    """Return per-field metrics of two evaluation iterations and their differences"""
+    try:
+        try:
+            eval_id = ObjectId(evaluation_iteration_id)
+            other_id = ObjectId(other_iteration_id)
+        except InvalidId:
+            raise HTTPException(status_code=400, detail='Invalid evaluation ID format')
+
+        db = get_db_connection()
+
+        iterations = list(db.evaluation_iterations.find(
+            {'_id': {'$in': [eval_id, other_id]}},
+            {'_id': 1}
+        ))
+        if len({iteration['_id'] for iteration in iterations}) != len({eval_id, other_id}):
+            raise HTTPException(status_code=404, detail='Evaluation not found')
+
+        rows = db.evaluation_metrics.find({
+            'evaluation_iteration_id': {'$in': [eval_id, other_id]},
+            'set_name': set_name
+        })
+        base, other = {}, {}
+        for row in rows:
+            target = base if row['evaluation_iteration_id'] == eval_id else other
+            target[row['field']] = {name: row[name] for name in METRIC_NAMES}
+
+        fields = {}
+        for field in sorted(set(base) | set(other)):
+            fields[field] = {
+                'base': base.get(field),
+                'other': other.get(field),
+                'delta': {
+                    name: other[field][name] - base[field][name] for name in METRIC_NAMES
+                } if field in base and field in other else None
+            }
+
+        return JSONResponse({
+            'evaluation_iteration_id': evaluation_iteration_id,
+            'other_iteration_id': other_iteration_id,
+            'set_name': set_name,
+            'fields': fields
+        })
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/use_case/{use_case_name}")
-async def delete_use_case(use_case_name: str):
+async def delete_use_case(use_case_name: str, background_tasks: BackgroundTasks):
+    """Mark a use case as deleting and remove its records and files in the background"""
     try:
         db = get_db_connection()
         
-        # Find use case
+        # Find use case, including one whose deletion was interrupted
         use_case = db.use_cases.find_one({'name': use_case_name})
         if not use_case:
             raise HTTPException(status_code=404, detail='Use case not found')
-            
-        # Delete associated label files
-        label_files = db.label_files.find({'use_case_id': use_case['_id']})
-        for label_file in label_files:
-            if os.path.exists(label_file['file_path']):
-                os.remove(label_file['file_path'])
-                
-        # Delete all related data
-        db.label_files.delete_many({'use_case_id': use_case['_id']})
-        db.evaluation_sets.delete_many({'use_case_id': use_case['_id']})
-        db.extraction_results.delete_many({'use_case_id': use_case['_id']})
-        db.evaluation_iterations.delete_many({'use_case_id': use_case['_id']})
-        
-        # Delete use case
-        db.use_cases.delete_one({'_id': use_case['_id']})
-        
-        return JSONResponse({'message': 'Use case and all related data deleted successfully'})
+
+        # A deletion already under way is only run here if its owner stopped
+        # (failed, or no heartbeat within the lease); otherwise the claim fails
+        already_deleting = (
+            use_case.get('status') == 'deleting' or mark_use_case_deleting(db, use_case) is None
+        )
+        background_tasks.add_task(run_cascade_delete, db, use_case['_id'])
+
+        if already_deleting:
+            return JSONResponse({'message': 'Use case deletion already in progress'}, status_code=202)
+        return JSONResponse({'message': 'Use case deletion started'}, status_code=202)
         
     except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/use_case/{use_case_name}/deletion")
+async def use_case_deletion_status(use_case_name: str):
+    """Report the progress of a use case deletion"""
+    try:
+        db = get_db_connection()
+
+        use_case = db.use_cases.find_one({'name': use_case_name}, {'status': 1, 'deletion': 1})
+        if not use_case:
+            # Completed deletions leave a tombstone behind
+            use_case = db.use_case_deletions.find_one({'name': use_case_name}, sort=[('completed_at', -1)])
+            if not use_case:
+                raise HTTPException(status_code=404, detail='Use case not found')
+        elif use_case.get('status') != 'deleting':
+            raise HTTPException(status_code=404, detail='Use case is not being deleted')
+
+        deletion = use_case['deletion']
+        return JSONResponse({
+            'state': deletion['state'],
+            'started_at': deletion['started_at'].isoformat(),
+            'updated_at': deletion['updated_at'].isoformat(),
+            'files_removed': deletion['files_removed'],
+            'deleted': deletion['deleted'],
+            'error': deletion['error']
+        })
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/evaluation/{evaluation_iteration_id}")
@@ -659,11 +1221,8 @@ async def delete_evaluation(evaluation_iteration_id: str):
         if not evaluation:
             raise HTTPException(status_code=404, detail='Evaluation not found')
             
-        # Delete extraction results
-        db.extraction_results.delete_one({'_id': evaluation['extraction_result_id']})
-        
-        # Delete evaluation
-        db.evaluation_iterations.delete_one({'_id': eval_id})
+        # Delete extraction results, metrics rollup and the evaluation itself
+        delete_evaluation_records(db, evaluation)
         
         return JSONResponse({'message': 'Evaluation and results deleted successfully'})
         
@@ -671,4 +1230,10 @@ async def delete_evaluation(evaluation_iteration_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == '__main__':
-    uvicorn.run("app:app", host="0.0.0.0", port=8001, reload=True)
+    load_dotenv()
+    if os.getenv('APP_ENV') == 'production':
+        # Multiple worker processes sharing UPLOAD_FOLDER, no reloader
+        uvicorn.run("app:app", host="0.0.0.0", port=8001,
+                    workers=int(os.getenv('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    else:
+        uvicorn.run("app:app", host="0.0.0.0", port=8001, reload=True)
@@ -0,0 +1,164 @@
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from label_sidecar import remove_label_file
+
+# Collections holding records of a use case, deleted before the use case itself.
+# label_files is handled last since its records point at the files on disk.
+CASCADE_COLLECTIONS = [
+    'evaluation_errors', 'evaluation_metrics', 'evaluation_iterations', 'extraction_results', 'evaluation_sets'
+]
+DELETE_BATCH_SIZE = 500
+MAX_WORKERS = 4
+DELETION_TOMBSTONE_TTL_SECONDS = 7 * 24 * 3600
+
+# A deletion is owned by one worker at a time. Its progress updates double as a
+# heartbeat; other workers only take over once it is older than the lease.
+DELETION_LEASE_SECONDS = 60
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class DeletionLeaseLost(Exception):
+    """Raised when another worker has taken over a deletion"""
+
+def mark_use_case_deleting(db, use_case):
+    """Mark a use case as being deleted and reset its deletion progress.
+    Returns None if it was already marked, e.g. by a concurrent request."""
+    deletion = {
+        'state': 'in_progress',
+        'started_at': datetime.now(timezone.utc),
+        'updated_at': datetime.now(timezone.utc),
+        'files_removed': 0,
+        'deleted': {collection: 0 for collection in CASCADE_COLLECTIONS + ['label_files']},
+        'error': None,
+        'owner': None
+    }
+    result = db.use_cases.update_one(
+        {'_id': use_case['_id'], 'status': {'$ne': 'deleting'}},
+        {'$set': {'status': 'deleting', 'deletion': deletion}}
+    )
+    return deletion if result.modified_count else None
+
+def claim_deletion(db, use_case_id):
+    """Take ownership of a deletion that has no owner or whose owner stopped
+    sending heartbeats. Returns False if another worker owns it."""
+    now = datetime.now(timezone.utc)
+    claimed = db.use_cases.find_one_and_update(
+        {
+            '_id': use_case_id,
+            'status': 'deleting',
+            '$or': [
+                {'deletion.owner': None},
+                {'deletion.updated_at': {'$lt': now - timedelta(seconds=DELETION_LEASE_SECONDS)}}
+            ]
+        },
+        {'$set': {
+            'deletion.owner': WORKER_ID,
+            'deletion.state': 'in_progress',
+            'deletion.error': None,
+            'deletion.updated_at': now
+        }}
+    )
+    return claimed is not None
+
+def _update_progress(db, use_case_id, increments):
+    result = db.use_cases.update_one(
+        {'_id': use_case_id, 'deletion.owner': WORKER_ID},
+        {
+            '$inc': increments,
+            '$set': {'deletion.updated_at': datetime.now(timezone.utc)}
+        }
+    )
+    if result.matched_count == 0:
+        raise DeletionLeaseLost(f"Deletion of use case {use_case_id} was taken over by another worker")
+
+def _delete_in_batches(db, collection, use_case_id):
+    """Delete the records of a use case from a collection in bounded batches"""
+    while True:
+        ids = [
+            record['_id']
+            for record in db[collection].find({'use_case_id': use_case_id}, {'_id': 1}).limit(DELETE_BATCH_SIZE)
+        ]
+        if not ids:
+            return
+        result = db[collection].delete_many({'_id': {'$in': ids}})
+        _update_progress(db, use_case_id, {f'deletion.deleted.{collection}': result.deleted_count})
+
+def _remove_label_files(db, use_case_id, executor):
+    """Remove label files and their sidecars from storage in bounded batches"""
+    cursor = db.label_files.find({'use_case_id': use_case_id}, {'file_path': 1}).batch_size(DELETE_BATCH_SIZE)
+    batch = []
+    for label_file in cursor:
+        batch.append(label_file['file_path'])
+        if len(batch) == DELETE_BATCH_SIZE:
+            removed = sum(executor.map(remove_label_file, batch))
+            _update_progress(db, use_case_id, {'deletion.files_removed': removed})
+            batch = []
+    if batch:
+        removed = sum(executor.map(remove_label_file, batch))
+        _update_progress(db, use_case_id, {'deletion.files_removed': removed})
+
+def _write_tombstone(db, use_case_id):
+    """Keep a small record of a completed deletion so its status can still be reported"""
+    use_case = db.use_cases.find_one({'_id': use_case_id}, {'name': 1, 'deletion': 1})
+    if not use_case:
+        return
+    completed_at = datetime.now(timezone.utc)
+    deletion = dict(use_case['deletion'], state='completed', updated_at=completed_at, error=None)
+    db.use_case_deletions.update_one(
+        {'_id': use_case_id},
+        {'$set': {'name': use_case['name'], 'completed_at': completed_at, 'deletion': deletion}},
+        upsert=True
+    )
+
+def run_cascade_delete(db, use_case_id):
+    """Delete a use case marked as deleting together with all its records and files.
+
+    The deletion is claimed first so only one worker runs it. Every step only
+    removes what is still there, so a worker taking over an interrupted run
+    picks up where it stopped. Returns whether the use case was deleted."""
+    if not claim_deletion(db, use_case_id):
+        return False
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            _remove_label_files(db, use_case_id, executor)
+            list(executor.map(
+                lambda collection: _delete_in_batches(db, collection, use_case_id),
+                CASCADE_COLLECTIONS
+            ))
+        _delete_in_batches(db, 'label_files', use_case_id)
+        _write_tombstone(db, use_case_id)
+        db.use_cases.delete_one({'_id': use_case_id, 'status': 'deleting', 'deletion.owner': WORKER_ID})
+        return True
+    except DeletionLeaseLost as e:
+        print(str(e))
+        return False
+    except Exception as e:
+        # Release the deletion so it can be retried
+        db.use_cases.update_one(
+            {'_id': use_case_id, 'deletion.owner': WORKER_ID},
+            {'$set': {
+                'deletion.state': 'failed',
+                'deletion.error': str(e),
+                'deletion.owner': None,
+                'deletion.updated_at': datetime.now(timezone.utc)
+            }}
+        )
+        print(f"Error deleting use case {use_case_id}: {str(e)}")
+        return False
+
+def resume_pending_deletions(db):
+    """Take over use case deletions that have no owner or a stale heartbeat.
+    Deletions still owned by a live worker are left alone."""
+    use_case_ids = [use_case['_id'] for use_case in db.use_cases.find({'status': 'deleting'}, {'_id': 1})]
+    return [use_case_id for use_case_id in use_case_ids if run_cascade_delete(db, use_case_id)]
+
+def delete_evaluation_records(db, evaluation):
+    """Delete an evaluation iteration with its extraction result and derived records.
+    The iteration itself goes last so a failed delete can simply be retried."""
+    db.extraction_results.delete_one({'_id': evaluation['extraction_result_id']})
+    db.evaluation_metrics.delete_many({'evaluation_iteration_id': evaluation['_id']})
+    db.evaluation_errors.delete_many({'evaluation_iteration_id': evaluation['_id']})
+    db.evaluation_iterations.delete_one({'_id': evaluation['_id']})
@@ -0,0 +1,324 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from itertools import accumulate
+
+from storage import atomic_write
+
+SIDECAR_SUFFIX = '.rows.bin'
+LEGACY_SIDECAR_SUFFIXES = ('.rows.pkl',)
+SIDECAR_MAGIC = b'LBLSCAR\0'
+SIDECAR_VERSION = 2
+
+# Fixed-width column layouts: (array typecode used to write, memoryview format used to read)
+TYPED_COLUMNS = {
+    'integer': ('q', 'q'),
+    'float': ('d', 'd'),
+    'boolean': ('B', '?')
+}
+
+# Per-process cache of mapped sidecars, keyed by sidecar path and bounded by the
+# total size of the mapped files
+SIDECAR_CACHE_BYTES = 256 * 1024 * 1024
+_sidecar_cache = OrderedDict()
+_sidecar_cache_lock = threading.Lock()
+
+def get_sidecar_path(file_path):
+    """Return the path of the pre-parsed sidecar for a label CSV file"""
+    return file_path + SIDECAR_SUFFIX
+
+def convert_value(field, value, column_types):
+    """Convert a string value of a CSV column according to the detected column type"""
+    try:
+        if column_types.get(field) == 'integer':
+            return int(value) if value.strip() else 0
+        elif column_types.get(field) == 'float':
+            return float(value) if value.strip() else 0.0
+        elif column_types.get(field) == 'boolean':
+            return value.lower() in ('true', '1', 'yes', 'y')
+        # Keep as string if type is string or unknown
+    except (ValueError, TypeError):
+        print(f"Warning: Could not convert {field} value '{value}' to {column_types.get(field)}")
+    return value
+
+def convert_row_values(row, column_types):
+    """Convert the string values of a CSV row according to the detected column types"""
+    for field, value in row.items():
+        if field != 'document_id':
+            row[field] = convert_value(field, value, column_types)
+    return row
+
+# Requests for more than this share of a file's rows decode whole columns at once
+# instead of looking up and slicing the mapping row by row
+BULK_READ_FRACTION = 1 / 16
+
+def _document_hash(document_id):
+    return zlib.crc32(document_id.encode('utf-8'))
+
+def _padding(length):
+    return -length % 8
+
+def _encode_strings(values):
+    """Encode strings as an offsets array and a UTF-8 blob of NUL-terminated values.
+    Returns the sections and whether the blob can be split on NUL as a whole."""
+    encoded = [(value or '').encode('utf-8') for value in values]
+    offsets = array('Q', [0])
+    offsets.extend(accumulate(len(value) + 1 for value in encoded))
+    separated = not any(b'\0' in value for value in encoded)
+    return [offsets.tobytes(), b'\0'.join(encoded) + b'\0' if encoded else b''], separated
+
+def _encode_column(column_type, values, raw_values):
+    """Return the layout of a column and its sections.
+
+    Typed columns are stored as fixed-width arrays. A typed column with values
+    that could not be converted keeps its raw strings and is converted on read,
+    like the CSV path does."""
+    if column_type in TYPED_COLUMNS:
+        python_type = {'integer': int, 'float': float, 'boolean': bool}[column_type]
+        if all(type(value) is python_type for value in values):
+            try:
+                return {'kind': column_type}, [array(TYPED_COLUMNS[column_type][0], values).tobytes()]
+            except OverflowError:
+                pass
+        sections, separated = _encode_strings(raw_values)
+        return {'kind': 'raw', 'separated': separated}, sections
+    sections, separated = _encode_strings(values)
+    return {'kind': 'string', 'separated': separated}, sections
+
+def write_label_sidecar(file_path, fieldnames, rows, column_types):
+    """Write typed rows of a label file to a memory-mappable sidecar next to the CSV.
+
+    The file holds a JSON header followed by 8-byte aligned sections: one
+    fixed-width array per typed column, offsets plus a UTF-8 blob per string
+    column, and a document_id hash -> row offset index sorted by hash."""
+    stat = os.stat(file_path)
+    fieldnames = list(fieldnames)
+    columns = {field: [] for field in fieldnames}
+    for row in rows:
+        converted = convert_row_values(dict(row), column_types)
+        for field in fieldnames:
+            columns[field].append(converted[field])
+
+    sections = []
+    position = 0
+
+    def add_section(data):
+        nonlocal position
+        start = position
+        sections.append(data)
+        sections.append(b'\0' * _padding(len(data)))
+        position += len(data) + _padding(len(data))
+        return [start, len(data)]
+
+    column_layouts = []
+    for field in fieldnames:
+        layout, parts = _encode_column(column_types.get(field), columns[field], [row[field] for row in rows])
+        layout.update(name=field, sections=[add_section(part) for part in parts])
+        column_layouts.append(layout)
+
+    entries = sorted((_document_hash(row['document_id']), offset) for offset, row in enumerate(rows))
+    index_layout = [
+        add_section(array('I', [document_hash for document_hash, _ in entries]).tobytes()),
+        add_section(array('Q', [offset for _, offset in entries]).tobytes())
+    ]
+
+    header = json.dumps({
+        'version': SIDECAR_VERSION,
+        'byteorder': sys.byteorder,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_size': stat.st_size,
+        'column_types': column_types,
+        'fieldnames': fieldnames,
+        'row_count': len(rows),
+        'columns': column_layouts,
+        'index': index_layout
+    }).encode('utf-8')
+    prefix = SIDECAR_MAGIC + struct.pack('<Q', len(header)) + header
+    prefix += b'\0' * _padding(len(prefix))
+
+    sidecar_path = get_sidecar_path(file_path)
+    with atomic_write(sidecar_path) as f:
+        f.write(prefix)
+        for section in sections:
+            f.write(section)
+    return sidecar_path
+
+def _map_sidecar(sidecar_path):
+    """Memory-map a sidecar and return its header with zero-copy views of its sections"""
+    with open(sidecar_path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(SIDECAR_MAGIC)] != SIDECAR_MAGIC:
+        return None
+    header_start = len(SIDECAR_MAGIC) + 8
+    (header_length,) = struct.unpack_from('<Q', mapped, len(SIDECAR_MAGIC))
+    payload = json.loads(mapped[header_start:header_start + header_length])
+    if payload.get('version') != SIDECAR_VERSION or payload.get('byteorder') != sys.byteorder:
+        return None
+
+    data_start = header_start + header_length
+    data_start += _padding(data_start)
+    view = memoryview(mapped)
+
+    def section(layout, view_format):
+        start = data_start + layout[0]
+        return view[start:start + layout[1]].cast(view_format)
+
+    payload['column_views'] = {}
+    for column in payload['columns']:
+        if column['kind'] in TYPED_COLUMNS:
+            values = section(column['sections'][0], TYPED_COLUMNS[column['kind']][1])
+        else:
+            # String values are sliced straight from the mapping by absolute position
+            blob_start = data_start + column['sections'][1][0]
+            values = (
+                section(column['sections'][0], 'Q'),
+                blob_start,
+                blob_start + column['sections'][1][1],
+                column['separated'],
+                mapped
+            )
+        payload['column_views'][column['name']] = (column['kind'], values)
+    payload['hashes'] = section(payload['index'][0], 'I')
+    payload['row_offsets'] = section(payload['index'][1], 'Q')
+    payload['nbytes'] = len(mapped)
+    return payload
+
+def load_label_sidecar(file_path, column_types=None):
+    """Map the sidecar of a label file, reusing the mapping if it is unchanged on disk.
+
+    Returns None if there is no sidecar, or if it is stale with respect to the
+    CSV file or was built with different column types."""
+    sidecar_path = get_sidecar_path(file_path)
+    try:
+        stat = os.stat(file_path)
+        sidecar_stat = os.stat(sidecar_path)
+        cache_key = (sidecar_stat.st_mtime_ns, sidecar_stat.st_size)
+        with _sidecar_cache_lock:
+            cached = _sidecar_cache.get(sidecar_path)
+            if cached is not None and cached[0] == cache_key:
+                _sidecar_cache.move_to_end(sidecar_path)
+                payload = cached[1]
+            else:
+                payload = None
+        if payload is None:
+            payload = _map_sidecar(sidecar_path)
+            if payload is None:
+                return None
+            if payload['nbytes'] <= SIDECAR_CACHE_BYTES:
+                with _sidecar_cache_lock:
+                    _sidecar_cache[sidecar_path] = (cache_key, payload)
+                    _sidecar_cache.move_to_end(sidecar_path)
+                    while _cached_bytes() > SIDECAR_CACHE_BYTES:
+                        _sidecar_cache.popitem(last=False)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if payload['source_mtime_ns'] != stat.st_mtime_ns or payload['source_size'] != stat.st_size:
+        return None
+    if (column_types or {}) != payload['column_types']:
+        return None
+    return payload
+
+def _cached_bytes():
+    return sum(payload['nbytes'] for _, payload in _sidecar_cache.values())
+
+def prefill_sidecar_cache(file_path, column_types=None):
+    """Map the sidecar of a label file into the cache ahead of the first read,
+    if it fits in what is left of the cache budget. Returns False once the
+    budget is used up, so callers can stop prefilling."""
+    sidecar_path = get_sidecar_path(file_path)
+    try:
+        size = os.stat(sidecar_path).st_size
+    except OSError:
+        return True
+    with _sidecar_cache_lock:
+        if sidecar_path not in _sidecar_cache and _cached_bytes() + size > SIDECAR_CACHE_BYTES:
+            return False
+    load_label_sidecar(file_path, column_types)
+    return True
+
+def _column_values(payload, name, rows, bulk):
+    """Read the values of one column for the given row offsets"""
+    kind, values = payload['column_views'][name]
+    if kind in TYPED_COLUMNS:
+        if bulk:
+            source = values.tolist()
+            return source if isinstance(rows, range) else [source[row] for row in rows]
+        return [values[row] for row in rows]
+
+    offsets, blob_start, blob_end, separated, mapped = values
+    if bulk and separated:
+        # One decode and split for the whole column
+        strings = mapped[blob_start:blob_end].decode('utf-8').split('\0')[:-1]
+        if not isinstance(rows, range):
+            strings = [strings[row] for row in rows]
+    else:
+        strings = [
+            mapped[blob_start + offsets[row]:blob_start + offsets[row + 1] - 1].decode('utf-8')
+            for row in rows
+        ]
+    if kind == 'raw':
+        column_types = payload['column_types']
+        return [convert_value(name, value, column_types) for value in strings]
+    return strings
+
+def _find_rows(payload, document_ids, bulk):
+    """Return the sorted row offsets of the given document IDs.
+
+    Small requests binary search the document_id hash index and check hash
+    matches against the stored document_id; bulk requests scan the decoded
+    document_id column instead."""
+    wanted = {document_id for document_id in document_ids if isinstance(document_id, str)}
+    if bulk:
+        stored_ids = _column_values(payload, 'document_id', range(payload['row_count']), bulk)
+        return [row for row, document_id in enumerate(stored_ids) if document_id in wanted]
+
+    hashes = payload['hashes']
+    row_offsets = payload['row_offsets']
+    candidates = []
+    for document_hash in {_document_hash(document_id) for document_id in wanted}:
+        position = bisect_left(hashes, document_hash)
+        while position < len(hashes) and hashes[position] == document_hash:
+            candidates.append(row_offsets[position])
+            position += 1
+    candidates.sort()
+    stored_ids = _column_values(payload, 'document_id', candidates, bulk)
+    return [row for row, document_id in zip(candidates, stored_ids) if document_id in wanted]
+
+def read_sidecar_rows(payload, document_ids):
+    """Return rows as dicts for the given document IDs (all rows if None).
+    Only the requested rows of each column are read from the mapping."""
+    row_count = payload['row_count']
+    if document_ids is None:
+        rows = range(row_count)
+        bulk = True
+    else:
+        bulk = len(document_ids) > row_count * BULK_READ_FRACTION
+        rows = _find_rows(payload, document_ids, bulk)
+
+    fieldnames = payload['fieldnames']
+    columns = [_column_values(payload, name, rows, bulk) for name in fieldnames]
+    return [dict(zip(fieldnames, values)) for values in zip(*columns)]
+
+def remove_label_file(file_path):
+    """Remove a label CSV file together with its sidecar.
+    Returns whether the CSV file was still there."""
+    with _sidecar_cache_lock:
+        _sidecar_cache.pop(get_sidecar_path(file_path), None)
+    removed = False
+    sidecar_paths = [get_sidecar_path(file_path)] + [file_path + suffix for suffix in LEGACY_SIDECAR_SUFFIXES]
+    for path in [file_path] + sidecar_paths:
+        try:
+            os.remove(path)
+            removed = removed or path == file_path
+        except FileNotFoundError:
+            # Already removed, possibly by another worker
+            pass
+    return removed
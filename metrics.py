@@ -1,7 +1,11 @@
 from datetime import datetime
 
-def calculate_metrics(actual_data, predicted_data, document_ids):
-    """Calculate precision, recall, and accuracy for each field"""
+ERROR_KINDS = ('mismatched', 'missing', 'spurious')
+
+def calculate_metrics(actual_data, predicted_data, document_ids, errors=None):
+    """Calculate precision, recall, and accuracy for each field.
+    If an errors dict is given, it is filled with the document_ids of the
+    mismatched, missing and spurious values of each field."""
     metrics = {}
     
     if not actual_data or not predicted_data:
@@ -10,15 +14,24 @@ def calculate_metrics(actual_data, predicted_data, document_ids):
     # Get all fields except document_id and row_id
     excluded_fields = {'document_id', 'row_id'}  # Explicitly exclude row_id
     fields = [field for field in actual_data[0].keys() if field not in excluded_fields]
+
+    # Index rows by document_id, keeping the first row of each document
+    actual_rows = {}
+    for row in actual_data:
+        actual_rows.setdefault(row['document_id'], row)
+    predicted_rows = {}
+    for row in predicted_data:
+        predicted_rows.setdefault(row['document_id'], row)
     
     for field in fields:
         true_positives = 0
         false_positives = 0
         false_negatives = 0
+        field_errors = {kind: [] for kind in ERROR_KINDS}
         
         for doc_id in document_ids:
-            actual = next((row[field] for row in actual_data if row['document_id'] == doc_id), None)
-            predicted = next((row.get(field) for row in predicted_data if row['document_id'] == doc_id), None)
+            actual = actual_rows[doc_id][field] if doc_id in actual_rows else None
+            predicted = predicted_rows[doc_id].get(field) if doc_id in predicted_rows else None
             if field == 'Officer Age':
                 print(actual, predicted, type(actual), type(predicted))
             
@@ -27,10 +40,13 @@ def calculate_metrics(actual_data, predicted_data, document_ids):
                     true_positives += 1
                 else:
                     false_positives += 1
+                    field_errors['mismatched'].append(doc_id)
             elif predicted:
                 false_positives += 1
+                field_errors['spurious'].append(doc_id)
             elif actual:
                 false_negatives += 1
+                field_errors['missing'].append(doc_id)
         
         precision = true_positives / (true_positives + false_positives) if (true_positives + false_positives) > 0 else 0
         recall = true_positives / (true_positives + false_negatives) if (true_positives + false_negatives) > 0 else 0
@@ -44,6 +60,8 @@ def calculate_metrics(actual_data, predicted_data, document_ids):
             'false_positives': false_positives,
             'false_negatives': false_negatives
         }
+        if errors is not None:
+            errors[field] = field_errors
     
     return metrics 
 
@@ -74,4 +92,43 @@ def detect_column_type(values):
         return 'boolean'
         
     # Default to string
-    return 'string' 
\ No newline at end of file
+    return 'string' 
+
+def flatten_metrics(evaluation_iteration):
+    """Flatten the nested metrics of an evaluation iteration into one row per (set, field)"""
+    rows = []
+    for set_name, set_metrics in evaluation_iteration.get('metrics', {}).items():
+        for field, field_metrics in set_metrics.items():
+            rows.append({
+                'evaluation_iteration_id': evaluation_iteration['_id'],
+                'use_case_id': evaluation_iteration['use_case_id'],
+                'created_at': evaluation_iteration['created_at'],
+                'set_name': set_name,
+                'field': field,
+                'precision': field_metrics['precision'],
+                'recall': field_metrics['recall'],
+                'f1_score': field_metrics['f1_score'],
+                'true_positives': field_metrics['true_positives'],
+                'false_positives': field_metrics['false_positives'],
+                'false_negatives': field_metrics['false_negatives']
+            })
+    return rows
+
+def flatten_errors(evaluation_iteration, errors_by_set, chunk_size):
+    """Flatten per-field error document_ids into inverted index rows of at most chunk_size ids"""
+    rows = []
+    for set_name, errors in errors_by_set.items():
+        for field, field_errors in errors.items():
+            for kind, document_ids in field_errors.items():
+                for chunk, start in enumerate(range(0, len(document_ids), chunk_size)):
+                    rows.append({
+                        'evaluation_iteration_id': evaluation_iteration['_id'],
+                        'use_case_id': evaluation_iteration['use_case_id'],
+                        'set_name': set_name,
+                        'field': field,
+                        'kind': kind,
+                        'chunk': chunk,
+                        'total': len(document_ids),
+                        'document_ids': document_ids[start:start + chunk_size]
+                    })
+    return rows
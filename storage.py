@@ -0,0 +1,31 @@
+import os
+import uuid
+from contextlib import contextmanager
+
+def _fsync_directory(path):
+    """Persist a rename by syncing its directory, where the platform allows it"""
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def atomic_write(file_path):
+    """Open a temporary file next to file_path for binary writing and rename it
+    into place on success, so concurrent workers and threads never see a
+    partially written file. Data and rename are synced to disk before returning."""
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+        _fsync_directory(os.path.dirname(file_path) or '.')
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
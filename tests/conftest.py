@@ -0,0 +1,8 @@
+import mongomock
+import pytest
+
+
+@pytest.fixture
+def db():
+    """An in-memory stand-in for the MongoDB database"""
+    return mongomock.MongoClient().evaluation_db
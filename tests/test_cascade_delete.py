@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+
+import cascade_delete
+from cascade_delete import DELETION_LEASE_SECONDS, claim_deletion, mark_use_case_deleting
+
+
+def deleting_use_case(db, owner, updated_at):
+    use_case = {'_id': 'uc1', 'name': 'invoices'}
+    db.use_cases.insert_one(dict(use_case))
+    mark_use_case_deleting(db, use_case)
+    db.use_cases.update_one(
+        {'_id': use_case['_id']},
+        {'$set': {'deletion.owner': owner, 'deletion.updated_at': updated_at}}
+    )
+    return use_case['_id']
+
+
+def test_claim_unowned_deletion(db):
+    use_case_id = deleting_use_case(db, None, datetime.now(timezone.utc))
+
+    assert claim_deletion(db, use_case_id)
+    assert db.use_cases.find_one({'_id': use_case_id})['deletion']['owner'] == cascade_delete.WORKER_ID
+
+
+def test_claim_fails_within_lease(db):
+    use_case_id = deleting_use_case(db, 'other-worker', datetime.now(timezone.utc))
+
+    assert not claim_deletion(db, use_case_id)
+    assert db.use_cases.find_one({'_id': use_case_id})['deletion']['owner'] == 'other-worker'
+
+
+def test_claim_takes_over_stale_lease(db):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=DELETION_LEASE_SECONDS + 1)
+    use_case_id = deleting_use_case(db, 'other-worker', stale)
+
+    assert claim_deletion(db, use_case_id)
+    assert db.use_cases.find_one({'_id': use_case_id})['deletion']['owner'] == cascade_delete.WORKER_ID
+
+
+def test_mark_use_case_deleting_only_once(db):
+    use_case = {'_id': 'uc1', 'name': 'invoices'}
+    db.use_cases.insert_one(dict(use_case))
+
+    assert mark_use_case_deleting(db, use_case) is not None
+    assert mark_use_case_deleting(db, use_case) is None
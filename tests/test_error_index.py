@@ -0,0 +1,49 @@
+from bson import ObjectId
+
+import app
+from metrics import ERROR_KINDS
+
+
+def store_errors(db, document_ids_by_kind):
+    evaluation_iteration = {'_id': ObjectId(), 'use_case_id': ObjectId()}
+    field_errors = {kind: document_ids_by_kind.get(kind, []) for kind in ERROR_KINDS}
+    app.store_error_index(db, evaluation_iteration, {'test_set': {'name': field_errors}})
+    return evaluation_iteration['_id']
+
+
+def test_page_crosses_chunk_boundary(db, monkeypatch):
+    monkeypatch.setattr(app, 'ERROR_INDEX_CHUNK_SIZE', 4)
+    mismatched = [f'doc{i:02d}' for i in range(10)]
+    iteration_id = store_errors(db, {'mismatched': mismatched})
+
+    assert db.evaluation_errors.count_documents({'evaluation_iteration_id': iteration_id}) == 3
+    total, items = app.page_error_index(db, iteration_id, 'test_set', 'name', ['mismatched'], 3, 6)
+
+    assert total == 10
+    assert items == [('mismatched', doc_id) for doc_id in mismatched[3:9]]
+
+
+def test_page_continues_into_next_kind(db, monkeypatch):
+    monkeypatch.setattr(app, 'ERROR_INDEX_CHUNK_SIZE', 4)
+    iteration_id = store_errors(db, {
+        'mismatched': ['a1', 'a2', 'a3', 'a4', 'a5'],
+        'missing': ['b1', 'b2', 'b3', 'b4', 'b5']
+    })
+
+    total, items = app.page_error_index(db, iteration_id, 'test_set', 'name', list(ERROR_KINDS), 3, 5)
+
+    assert total == 10
+    assert items == [
+        ('mismatched', 'a4'), ('mismatched', 'a5'),
+        ('missing', 'b1'), ('missing', 'b2'), ('missing', 'b3')
+    ]
+
+
+def test_page_past_the_end_is_empty(db, monkeypatch):
+    monkeypatch.setattr(app, 'ERROR_INDEX_CHUNK_SIZE', 4)
+    iteration_id = store_errors(db, {'spurious': ['c1', 'c2']})
+
+    total, items = app.page_error_index(db, iteration_id, 'test_set', 'name', list(ERROR_KINDS), 50, 50)
+
+    assert total == 2
+    assert items == []